@@ -4,43 +4,40 @@ AI-Powered Car Photo Evaluator
 Uses modern vision AI to understand photo content and quality for social media
 """
 
+import io
 import os
-import base64
+import random
+import re
 import json
-from pathlib import Path
+import asyncio
+import collections
+import contextlib
+import functools
+import hashlib
+import heapq
+import tempfile
+import textwrap
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import aiohttp
+import cv2
+import pybase64
+import numpy as np
+import orjson
 import requests
+from PIL import Image, ImageOps
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List, Dict, Tuple
 import argparse
 
-class AIPhotoEvaluator:
-    def __init__(self, api_key=None, detect_duplicates=True):
-        """Initialize with OpenAI API key or use local ollama"""
-        self.api_key = api_key
-        self.use_openai = api_key is not None
-        self.detect_duplicates = detect_duplicates
-        
-    def encode_image(self, image_path):
-        """Encode image to base64 with validation"""
-        try:
-            # Check file size (limit to 20MB for Ollama)
-            file_size = os.path.getsize(image_path)
-            if file_size > 20 * 1024 * 1024:
-                print(f"⚠️  Warning: {os.path.basename(image_path)} is {file_size/(1024*1024):.1f}MB (large file)")
-            
-            with open(image_path, "rb") as image_file:
-                encoded = base64.b64encode(image_file.read()).decode('utf-8')
-                return encoded
-        except Exception as e:
-            print(f"❌ Error encoding {os.path.basename(image_path)}: {e}")
-            return None
-    
-    def evaluate_with_openai(self, image_path):
-        """Evaluate using GPT-4V"""
-        base64_image = self.encode_image(image_path)
-        
-        prompt = """Rate this car photo for social media appeal (Instagram/TikTok) on a scale of 1-100.
+# Evaluations are remembered here by file content, so re-running on a folder only pays
+# for new photos. Saved at most every RESULT_CACHE_SAVE_INTERVAL seconds during a run.
+RESULT_CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                 'autocurator', 'results.json')
+RESULT_CACHE_SAVE_INTERVAL = 5
 
-TECHNICAL REQUIREMENTS (must pass or score drops to 30 or below):
+OPENAI_RUBRIC = """TECHNICAL REQUIREMENTS (must pass or score drops to 30 or below):
 - Photo must be sharp and in focus
 - Subject must be clearly visible
 - No excessive blur or camera shake
@@ -62,69 +59,46 @@ HEAVY PENALTIES for:
 - Poor lighting on the car itself
 - Boring angles or compositions
 
-A blurry photo of a Ferrari should score lower than a sharp photo of a Camry.
+A blurry photo of a Ferrari should score lower than a sharp photo of a Camry."""
+
+OPENAI_RESULT_FIELDS = '''"score": [1-100],
+"reasoning": "Brief explanation of why this score",
+"main_subject": "What is the primary subject of this photo",
+"social_media_appeal": "Why this would/wouldn't work for social media",
+"improvements": "What could make this photo better",
+"caption": "Ready-to-use Instagram/social media caption with relevant hashtags"'''
+
+OPENAI_PROMPT = f"""Rate this car photo for social media appeal (Instagram/TikTok) on a scale of 1-100.
+
+{OPENAI_RUBRIC}
 
 Respond with ONLY a JSON object:
-{
-  "score": [1-100],
-  "reasoning": "Brief explanation of why this score",
-  "main_subject": "What is the primary subject of this photo",
-  "social_media_appeal": "Why this would/wouldn't work for social media",
-  "improvements": "What could make this photo better",
-  "caption": "Ready-to-use Instagram/social media caption with relevant hashtags"
-}"""
-
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
-        }
-        
-        payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
-                        }
-                    ]
-                }
-            ],
-            "max_tokens": 500
-        }
-        
-        try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                content = response.json()['choices'][0]['message']['content']
-                # Try to extract JSON from the response
-                if '{' in content and '}' in content:
-                    json_start = content.find('{')
-                    json_end = content.rfind('}') + 1
-                    json_str = content[json_start:json_end]
-                    return json.loads(json_str)
-                else:
-                    return {"score": 50, "reasoning": "Could not parse AI response", "error": content}
-            else:
-                return {"score": 0, "reasoning": f"API Error: {response.status_code}", "error": response.text}
-                
-        except Exception as e:
-            return {"score": 0, "reasoning": f"Error: {str(e)}"}
-    
-    def evaluate_with_ollama(self, image_path):
-        """Evaluate using local Ollama with vision model"""
-        base64_image = self.encode_image(image_path)
-        
-        prompt = """Rate this car photo for social media appeal on a scale of 1-100.
+{{
+{textwrap.indent(OPENAI_RESULT_FIELDS, '  ')}
+}}"""
+
+def openai_batch_prompt(file_names):
+    """Prompt for grading several photos in one request, attached in the order of file_names"""
+    file_list = '\n'.join(f"{n}. {name}" for n, name in enumerate(file_names, 1))
+    return f"""Rate each of these {len(file_names)} car photos for social media appeal (Instagram/TikTok) on a scale of 1-100.
+The photos are attached in this order:
+{file_list}
+
+Judge every photo on its own against these criteria:
+
+{OPENAI_RUBRIC}
+
+Respond with ONLY a JSON object with one entry per photo, in the same order:
+{{
+  "results": [
+    {{
+      "file": "File name from the list above",
+{textwrap.indent(OPENAI_RESULT_FIELDS, '      ')}
+    }}
+  ]
+}}"""
+
+OLLAMA_PROMPT = """Rate this car photo for social media appeal on a scale of 1-100.
 
 TECHNICAL REQUIREMENTS FIRST:
 ✓ Photo must be sharp and clear
@@ -155,61 +129,7 @@ Give a score 1-100 and brief reasoning. Focus on social media appeal, not just t
 
 Also create a ready-to-use social media caption with relevant hashtags for this photo."""
 
-        try:
-            response = requests.post(
-                'http://localhost:11434/api/generate',
-                json={
-                    'model': 'llava:latest',
-                    'prompt': prompt,
-                    'images': [base64_image],
-                    'stream': False
-                },
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                response_text = result.get('response', '')
-                
-                # Try to extract score from response
-                score = 50  # default
-                if 'score' in response_text.lower():
-                    import re
-                    score_match = re.search(r'(\d+)(?:/100)?', response_text)
-                    if score_match:
-                        score = min(100, max(1, int(score_match.group(1))))
-                
-                return {
-                    "score": score,
-                    "reasoning": response_text,
-                    "main_subject": "Analysis via Ollama",
-                    "social_media_appeal": response_text
-                }
-            else:
-                return {"score": 0, "reasoning": f"Ollama error: {response.status_code}"}
-                
-        except requests.exceptions.ConnectionError:
-            return {"score": 0, "reasoning": "Ollama not running. Start with: ollama serve"}
-        except Exception as e:
-            return {"score": 0, "reasoning": f"Error: {str(e)}"}
-    
-    def are_photos_similar(self, image_path1, image_path2):
-        """Check if two photos are similar shots of the same subject"""
-        if not self.detect_duplicates:
-            return False
-        
-        # Don't compare if either image failed to load during evaluation
-        # This prevents false positives from failed images
-        if not os.path.exists(image_path1) or not os.path.exists(image_path2):
-            return False
-            
-        base64_image1 = self.encode_image(image_path1)
-        base64_image2 = self.encode_image(image_path2)
-        
-        if base64_image1 is None or base64_image2 is None:
-            return False
-        
-        prompt = """Compare these two car photos. Are they similar shots of the same car/subject from similar angles?
+SIMILARITY_PROMPT = """Compare these two car photos. Are they similar shots of the same car/subject from similar angles?
 
 Consider them SIMILAR only if:
 - Same specific car, similar angle/composition
@@ -225,134 +145,909 @@ Consider them DIFFERENT if:
 
 Be CONSERVATIVE - when in doubt, consider them DIFFERENT.
 
-Respond with only: SIMILAR or DIFFERENT"""
+Respond with only a JSON object: {"similar": true} if SIMILAR, {"similar": false} if DIFFERENT"""
+
+# Structured output schema for SIMILARITY_PROMPT, so the reply is a handful of tokens
+SIMILARITY_SCHEMA = {
+    "type": "object",
+    "properties": {"similar": {"type": "boolean"}},
+    "required": ["similar"],
+    "additionalProperties": False
+}
+
+# Stands in for each base64 image while a request template is serialized
+IMAGE_SLOT = "@@autocurator-image@@"
+
+def openai_payload(prompt, image_urls, max_tokens, json_schema=None):
+    """Chat completion request body with a text prompt followed by images"""
+    content = [{"type": "text", "text": prompt}]
+    for url in image_urls:
+        content.append({"type": "image_url", "image_url": {"url": url}})
+    payload = {
+        "model": "gpt-4o",
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": max_tokens
+    }
+    if json_schema is not None:
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": "answer", "strict": True, "schema": json_schema}
+        }
+    return payload
+
+def ollama_payload(prompt, images, max_tokens=None, json_schema=None):
+    """Ollama /api/generate request body; Ollama's JSON mode stands in for a schema
+    
+    max_tokens=None leaves the reply length uncapped.
+    """
+    payload = {
+        'model': 'llava:latest',
+        'prompt': prompt,
+        'images': images,
+        'stream': False
+    }
+    if max_tokens is not None:
+        payload['options'] = {'num_predict': max_tokens}
+    if json_schema is not None:
+        payload['format'] = 'json'
+    return payload
+
+# Fixed prompts hit the cache on every request; per-group --images-per-call prompts never
+# repeat, so the cache is kept small enough that they can't pile up
+@functools.lru_cache(maxsize=16)
+def request_template(use_openai, prompt, image_count, max_tokens, schema_json=None):
+    """Serialized vision request body, split at the image slots into image_count + 1 pieces
+    
+    Cached, so each fixed prompt/shape is serialized once per run instead of on every request.
+    """
+    json_schema = orjson.loads(schema_json) if schema_json is not None else None
+    if use_openai:
+        payload = openai_payload(prompt, ["data:image/jpeg;base64," + IMAGE_SLOT] * image_count,
+                                 max_tokens, json_schema)
+    else:
+        payload = ollama_payload(prompt, [IMAGE_SLOT] * image_count, max_tokens, json_schema)
+    return tuple(orjson.dumps(payload).split(IMAGE_SLOT.encode()))
+
+def splice_images(pieces, images_b64):
+    """Interleave request_template pieces with base64 images; the images are not copied"""
+    parts = [pieces[0]]
+    for base64_image, piece in zip(images_b64, pieces[1:]):
+        parts += (base64_image, piece)
+    return parts
+
+def coerce_score(value):
+    """A model's score as an int clamped to 1-100, or None if it isn't a number"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        value = value.strip().split('/')[0]  # "85" or "85/100"
+    try:
+        return min(100, max(1, int(float(value))))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def extract_json(content):
+    """Pull a JSON object out of a model reply, tolerating code fences and surrounding prose
+    
+    Returns a dict, or None if the reply holds no JSON object.
+    """
+    text = content.strip()
+    if text.startswith('```'):
+        # ```json ... ``` fences: drop the opening line and the closing fence
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    try:
+        parsed = orjson.loads(text)
+        if isinstance(parsed, dict):
+            return parsed
+    except ValueError:
+        pass
+    # Otherwise look for an object inside the text; lists, numbers etc. don't count
+    json_start = text.find('{')
+    json_end = text.rfind('}') + 1
+    if json_start == -1 or json_end <= json_start:
+        return None
+    try:
+        parsed = orjson.loads(text[json_start:json_end])
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
 
+# "Score: 85/100", "score of 72", ... in free-text Ollama replies: the first number
+# shortly after the word "score"
+SCORE_RE = re.compile(r'score[^0-9]{0,20}(\d{1,3})', re.IGNORECASE)
+
+# OpenAI's x-ratelimit-reset-* headers are durations like "1s", "6m0s" or "120ms"
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+def parse_duration(value):
+    """Seconds in a Retry-After or x-ratelimit-reset-* header value, or None if unparseable"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+# Perceptual hash distance bands (out of 64 bits) used to prefilter duplicate detection:
+# at or below SIMILAR the pair is grouped without asking the AI, above DIFFERENT it is
+# skipped, and only the ambiguous band in between costs a vision API comparison.
+PHASH_SIMILAR_DISTANCE = 6
+PHASH_DIFFERENT_DISTANCE = 12
+
+# Images are read and base64-encoded in chunks of this many bytes. It must be a multiple
+# of 3 so that only the final chunk can produce '=' padding.
+B64_CHUNK_SIZE = 3 * 1024 * 1024
+
+# Vision models resize inputs to roughly 512-1024px internally, so anything larger than
+# this is recompressed before upload; smaller files are sent untouched
+DOWNSCALE_MIN_BYTES = 512 * 1024
+
+# Total base64 bytes kept in memory for duplicate detection, least recently used evicted first
+B64_CACHE_BYTES = 256 * 1024 * 1024
+
+# Photos whose Laplacian variance (measured at quarter resolution, close to what the vision
+# model sees) falls below this are treated as out of focus and never sent to the API
+BLUR_THRESHOLD = 80.0
+BLURRY_SCORE = 20
+
+def ollama_num_parallel():
+    """OLLAMA_NUM_PARALLEL from the environment, or None if unset or invalid"""
+    try:
+        return max(1, int(os.environ['OLLAMA_NUM_PARALLEL']))
+    except (KeyError, ValueError):
+        return None
+
+def iter_b64(image_path, chunk_size=B64_CHUNK_SIZE):
+    """Yield the base64 encoding of a file chunk by chunk, never holding the whole raw file"""
+    if chunk_size % 3:
+        raise ValueError("chunk_size must be a multiple of 3 to avoid padding mid-stream")
+    with open(image_path, "rb") as image_file:
+        while True:
+            chunk = image_file.read(chunk_size)
+            if not chunk:
+                break
+            # pybase64 dispatches to SIMD (AVX2/NEON) kernels at runtime
+            yield pybase64.b64encode(chunk)
+
+def perceptual_hash(image_path):
+    """Compute a 64-bit DCT perceptual hash (pHash) of an image, or None if it can't be read"""
+    try:
+        with Image.open(image_path) as img:
+            # Let the JPEG decoder downscale while decoding instead of decoding full resolution
+            img.draft('L', (64, 64))
+            small = img.convert('L').resize((32, 32), Image.LANCZOS)
+        pixels = np.asarray(small, dtype=np.float32)
+        low_freq = cv2.dct(pixels)[:8, :8].flatten()
+        # Compare against the median of the low frequencies, ignoring the DC term
+        bits = low_freq > np.median(low_freq[1:])
+        return int(''.join('1' if bit else '0' for bit in bits), 2)
+    except Exception as e:
+        print(f"   ⚠️  Could not hash {os.path.basename(image_path)}: {e}")
+        return None
+
+def sharpness(image_path):
+    """Variance of the Laplacian of a grayscale, quarter-size decode; None if it can't be read
+    
+    Module-level so it can be shipped to a process pool worker.
+    """
+    try:
+        # JPEG decoding does the reduction itself (DCT scaling), so this never decodes full size
+        gray = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            return None
+        return cv2.Laplacian(gray, cv2.CV_64F).var()
+    except Exception:
+        return None
+
+def hamming_distance(hash1, hash2):
+    """Number of differing bits between two perceptual hashes"""
+    return bin(hash1 ^ hash2).count('1')
+
+def file_digest(image_path):
+    """SHA-256 of a file's contents, read in 1MB chunks"""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def downscale_image(image_path, max_dim):
+    """Shrink image so its longest side is at most max_dim and re-encode as JPEG"""
+    try:
+        with Image.open(image_path) as img:
+            img.draft('RGB', (max_dim, max_dim))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=85, optimize=True)
+            return buffer
+    except Exception as e:
+        print(f"⚠️  Could not downscale {os.path.basename(image_path)}, sending original: {e}")
+        return None
+
+def encode_image_file(image_path, max_dim=1024):
+    """Encode image to base64 ASCII bytes (or bytearray) with validation
+    
+    Module-level (not a method) so it can be shipped to a process pool worker.
+    """
+    try:
+        # Check file size (limit to 20MB for Ollama)
+        file_size = os.path.getsize(image_path)
+        if max_dim and file_size > DOWNSCALE_MIN_BYTES:
+            downscaled = downscale_image(image_path, max_dim)
+            if downscaled is not None:
+                return pybase64.b64encode(downscaled.getbuffer())
+        
+        if file_size > 20 * 1024 * 1024:
+            print(f"⚠️  Warning: {os.path.basename(image_path)} is {file_size/(1024*1024):.1f}MB (large file)")
+        
+        # Fill a buffer sized for the final output chunk by chunk, so only one raw chunk
+        # is alive at a time instead of the whole file next to its encoding
+        encoded = bytearray(4 * ((file_size + 2) // 3))
+        pos = 0
+        for piece in iter_b64(image_path):
+            encoded[pos:pos + len(piece)] = piece
+            pos += len(piece)
+        del encoded[pos:]  # in case the file changed size while being read
+        return encoded
+    except Exception as e:
+        print(f"❌ Error encoding {os.path.basename(image_path)}: {e}")
+        return None
+
+def result_score(result):
+    """Sort key ranking results by score"""
+    return result.get('score', 0)
+
+class VisionAPIError(Exception):
+    """A vision API answered a request with a non-200 status"""
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.body = body
+
+# OpenAI rejects Batch API input files over 200MB or 50,000 requests; stay a little under
+BATCH_FILE_MAX_BYTES = 190 * 1024 * 1024
+BATCH_MAX_REQUESTS = 50000
+
+# A request answered 429 is retried after Retry-After (or exponential backoff) this many times
+RATE_LIMIT_RETRIES = 5
+
+class AdaptiveLimiter:
+    """Cap on in-flight vision requests that backs off under rate limiting and then recovers
+    
+    The limit starts at max_limit. A 429 halves it, and OpenAI's remaining-requests header
+    lowers it to what the current window still allows; either way it grows back after the
+    advertised reset time. Must be created inside the running event loop.
+    """
+    def __init__(self, max_limit):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+        self._refill = None
+    
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Hold one request slot, waiting while the limit is used up"""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+    
+    async def observe(self, headers):
+        """Shrink the limit to OpenAI's remaining request budget until the window resets"""
+        remaining = headers.get('x-ratelimit-remaining-requests')
+        if remaining is None or not remaining.isdigit() or int(remaining) >= self.limit:
+            return
+        await self._shrink(max(1, int(remaining)), parse_duration(headers.get('x-ratelimit-reset-requests')))
+    
+    async def throttle(self, retry_after):
+        """Halve the limit after a 429 and grow it back once retry_after seconds have passed"""
+        await self._shrink(max(1, self.limit // 2), retry_after)
+    
+    async def _shrink(self, limit, refill_after):
+        async with self._cond:
+            if limit < self.limit:
+                print(f"   🐢 Rate limited, lowering concurrency to {limit}")
+            self.limit = min(self.limit, limit)
+        # A newer signal replaces any pending refill
+        if self._refill is not None:
+            self._refill.cancel()
+        self._refill = asyncio.ensure_future(self._grow_after(refill_after or 1.0))
+    
+    async def _grow_after(self, delay):
+        # Double back toward max_limit one step at a time rather than jumping straight there
+        while self.limit < self.max_limit:
+            await asyncio.sleep(delay)
+            async with self._cond:
+                self.limit = min(self.max_limit, self.limit * 2)
+                self._cond.notify_all()
+    
+    def close(self):
+        """Cancel a pending refill"""
+        if self._refill is not None:
+            self._refill.cancel()
+
+class AIPhotoEvaluator:
+    def __init__(self, api_key=None, detect_duplicates=True, concurrency=None, max_dim=1024,
+                 images_per_call=1, use_batch_api=False, force=False, result_cache_path=RESULT_CACHE_PATH,
+                 blur_threshold=BLUR_THRESHOLD):
+        """Initialize with OpenAI API key or use local ollama"""
+        self.api_key = api_key
+        self.use_openai = api_key is not None
+        self.detect_duplicates = detect_duplicates
+        self.max_dim = max_dim  # longest side sent to the model; 0 or None sends originals
+        # OpenAI handles many parallel requests; a local Ollama mostly queues them
+        # (for Ollama, as many as the server is configured to run at once)
+        if concurrency is None:
+            concurrency = 8 if self.use_openai else ollama_num_parallel() or 2
+        self.concurrency = max(1, concurrency)
+        # Photos graded per OpenAI request; the rubric prompt is then paid for once per group
+        self.images_per_call = max(1, images_per_call)
+        # Offline evaluation through OpenAI's /v1/batches instead of live requests
+        self.use_batch_api = use_batch_api and self.use_openai
+        # Local focus check that fails photos before any API call; 0 or None disables it
+        self.blur_threshold = blur_threshold
+        
+        # Content-hash keyed results from earlier runs; force re-evaluates everything
+        self.force = force
+        self.result_cache_path = result_cache_path
+        self._result_cache = None  # loaded on first use
+        self._result_cache_saved_at = 0.0
+        self._digests: Dict[str, Tuple[int, int, str]] = {}  # path -> (mtime_ns, size, sha256)
+        self._http = None  # aiohttp session, only open inside _http_session()
+        self._limiter = None  # AdaptiveLimiter for the same span
+        self._http_users = 0  # coroutines currently inside _http_session()
+        
+        # Synchronous session for the Batch API calls; reuses connections instead of a fresh
+        # TCP+TLS handshake per request. Only idempotent methods are retried, so a failed
+        # POST can never create the same batch twice.
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        
+        # path -> (mtime_ns, size, base64); an ambiguous photo in duplicate detection is sent in
+        # several comparisons. Only those encodings are kept, up to B64_CACHE_BYTES in total.
+        self._b64_cache: Dict[str, Tuple[int, int, bytes]] = collections.OrderedDict()
+        self._b64_cache_bytes = 0
+        # Encoding (JPEG decode/resize + base64) is CPU-bound, so during a folder run it goes
+        # to a process pool
+        self._encode_pool = None
+        
+    def _cached_encoding(self, image_path):
+        """Return (stat, cached base64 or None); stat is None if the file can't be read"""
+        try:
+            stat = os.stat(image_path)
+        except OSError as e:
+            print(f"❌ Error encoding {os.path.basename(image_path)}: {e}")
+            return None, None
+        
+        cached = self._b64_cache.get(image_path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            self._b64_cache.move_to_end(image_path)
+            return stat, cached[2]
+        return stat, None
+    
+    def _remember_encoding(self, image_path, stat, encoded):
+        if encoded is None or len(encoded) > B64_CACHE_BYTES:
+            return
+        previous = self._b64_cache.pop(image_path, None)
+        if previous is not None:
+            self._b64_cache_bytes -= len(previous[2])
+        self._b64_cache[image_path] = (stat.st_mtime_ns, stat.st_size, encoded)
+        self._b64_cache_bytes += len(encoded)
+        while self._b64_cache_bytes > B64_CACHE_BYTES:
+            _, (_, _, evicted) = self._b64_cache.popitem(last=False)
+            self._b64_cache_bytes -= len(evicted)
+    
+    async def encode_image_async(self, image_path, remember=False):
+        """Encode image to base64 in the process pool, reusing a cached encoding while the file is unchanged
+        
+        Only remember=True encodings are added to the cache.
+        """
+        stat, encoded = self._cached_encoding(image_path)
+        if stat is None or encoded is not None:
+            return encoded
+        
+        encoded = await asyncio.get_running_loop().run_in_executor(
+            self._encode_pool, encode_image_file, image_path, self.max_dim)
+        if remember:
+            self._remember_encoding(image_path, stat, encoded)
+        return encoded
+    
+    def _content_key(self, image_path):
+        """Result cache key: the backend plus the SHA-256 of the file contents"""
+        stat = os.stat(image_path)
+        known = self._digests.get(image_path)
+        if not known or known[0] != stat.st_mtime_ns or known[1] != stat.st_size:
+            known = (stat.st_mtime_ns, stat.st_size, file_digest(image_path))
+            self._digests[image_path] = known
+        backend = 'openai' if self.use_openai else 'ollama'
+        return f"{backend}:{known[2]}"
+    
+    def _load_result_cache(self):
+        if self._result_cache is None:
+            try:
+                with open(self.result_cache_path, 'rb') as f:
+                    self._result_cache = orjson.loads(f.read())
+            except (OSError, ValueError):
+                self._result_cache = {}
+        return self._result_cache
+    
+    def save_result_cache(self, flush=True):
+        """Write cached results to disk; with flush=False only if the last save is a few seconds old"""
+        if self._result_cache is None:
+            return
+        if not flush and time.monotonic() - self._result_cache_saved_at < RESULT_CACHE_SAVE_INTERVAL:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.result_cache_path), exist_ok=True)
+            # Write then rename so an interrupted run never leaves a truncated cache behind
+            temp_path = self.result_cache_path + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(orjson.dumps(self._result_cache))
+            os.replace(temp_path, self.result_cache_path)
+            self._result_cache_saved_at = time.monotonic()
+        except (OSError, orjson.JSONEncodeError) as e:
+            print(f"⚠️  Could not save result cache: {e}")
+    
+    def cached_result(self, image_path):
+        """Result from an earlier evaluation of a photo with identical contents, or None"""
+        if self.force:
+            return None
+        try:
+            key = self._content_key(image_path)
+        except OSError:
+            return None
+        cached = self._load_result_cache().get(key)
+        if cached is None:
+            return None
+        result = dict(cached)
+        result['file'] = os.path.basename(image_path)
+        result['path'] = image_path
+        return result
+    
+    def remember_result(self, image_path, result):
+        """Cache a successful evaluation so later runs can skip the API call"""
+        if not result or result.get('score', 0) <= 0 or 'error' in result:
+            return
+        try:
+            key = self._content_key(image_path)
+        except OSError:
+            return
+        self._load_result_cache()[key] = {k: v for k, v in result.items()
+                                          if k not in ('file', 'path', 'similar_shots', 'alternatives')}
+        self.save_result_cache(flush=False)
+    
+    def _openai_result(self, content):
+        """Turn GPT-4o's reply to OPENAI_PROMPT into a result dict"""
+        return self._checked_openai_result(extract_json(content), content)
+    
+    def _checked_openai_result(self, result, content):
+        """Normalize a parsed result's score to an int in 1-100, or report the reply as unparseable"""
+        score = coerce_score(result.get('score')) if result is not None else None
+        if score is None:
+            return {"score": 50, "reasoning": "Could not parse AI response", "error": content}
+        result['score'] = score
+        return result
+    
+    def _openai_batch_results(self, file_names, content):
+        """Split GPT-4o's reply to openai_batch_prompt into one result per file (None if missing)"""
+        parsed = extract_json(content)
+        entries = (parsed.get('results') or []) if parsed is not None else []
+        if not isinstance(entries, list):
+            entries = []
+        entries = [e for e in entries if isinstance(e, dict)]
+        by_name = {}
+        for entry in entries:
+            by_name.setdefault(entry.get('file'), entry)
+        matched = [by_name.get(name) for name in file_names]
+        # Fall back to answer order only if the model mangled every file name; mixing the two
+        # could hand one photo's grade to another
+        if all(entry is None for entry in matched) and len(entries) == len(file_names):
+            matched = entries
+        # Copies, so no two results ever share a dict
+        return [self._checked_openai_result({k: v for k, v in entry.items() if k != 'file'}, content)
+                if entry is not None else None
+                for entry in matched]
+    
+    def _ollama_result(self, response_text):
+        """Turn LLaVA's free-text reply to OLLAMA_PROMPT into a result dict"""
+        # Try to extract score from response
+        score = 50  # default
+        score_match = SCORE_RE.search(response_text)
+        if score_match:
+            score = min(100, max(1, int(score_match.group(1))))
+        
+        return {
+            "score": score,
+            "reasoning": response_text,
+            "main_subject": "Analysis via Ollama",
+            "social_media_appeal": response_text
+        }
+    
+    def _error_result(self, error):
+        """Result dict for a grading request that failed"""
+        if isinstance(error, VisionAPIError):
+            if self.use_openai:
+                return {"score": 0, "reasoning": f"API Error: {error.status}", "error": error.body}
+            return {"score": 0, "reasoning": f"Ollama error: {error.status}"}
+        if isinstance(error, aiohttp.ClientConnectorError) and not self.use_openai:
+            return {"score": 0, "reasoning": "Ollama not running. Start with: ollama serve"}
+        return {"score": 0, "reasoning": f"Error: {str(error)}"}
+    
+    async def _chat_vision(self, prompt, images_b64, max_tokens, timeout=None, json_schema=None):
+        """Send a prompt with base64 images to the active vision backend and return the reply text
+        
+        Every vision request goes through here, so all of them share the run's aiohttp session
+        and connection pool, and the adaptive limit that backs off and retries on 429s. With
+        json_schema the reply is constrained to matching JSON (OpenAI structured outputs;
+        Ollama's JSON mode). max_tokens=None (Ollama only) leaves the reply uncapped. Raises
+        VisionAPIError on a non-200 answer.
+        """
         if self.use_openai:
+            url = "https://api.openai.com/v1/chat/completions"
             headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {self.api_key}"
             }
-            
-            payload = {
-                "model": "gpt-4o",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image1}"}},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image2}"}}
-                        ]
-                    }
-                ],
-                "max_tokens": 50
-            }
+            if timeout is None:
+                timeout = 30
+        else:
+            url = 'http://localhost:11434/api/generate'
+            headers = {"Content-Type": "application/json"}
+            if timeout is None:
+                timeout = 60
+        
+        # Everything but the images is the same on every call, so the body is pre-serialized
+        # once per prompt and the base64 images are spliced into its slots
+        schema_json = orjson.dumps(json_schema, option=orjson.OPT_SORT_KEYS) if json_schema is not None else None
+        pieces = request_template(self.use_openai, prompt, len(images_b64), max_tokens, schema_json)
+        data = b''.join(splice_images(pieces, images_b64))
+        
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            async with self._limiter.slot():
+                async with self._http.post(url, headers=headers, data=data,
+                                           timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    body = await response.read()
+                    status, response_headers = response.status, response.headers
+            await self._limiter.observe(response_headers)
+            if status != 429 or attempt == RATE_LIMIT_RETRIES:
+                break
+            # Wait outside the slot so requests that are not rate limited can still go out
+            retry_after = parse_duration(response_headers.get('retry-after')) or 2 ** attempt
+            await self._limiter.throttle(retry_after)
+            await asyncio.sleep(retry_after)
+        
+        if status != 200:
+            raise VisionAPIError(status, body.decode('utf-8', 'replace'))
+        
+        if self.use_openai:
+            return orjson.loads(body)['choices'][0]['message']['content']
+        return orjson.loads(body).get('response', '')
+    
+    async def _send_evaluation(self, file_names, encodings):
+        """Send one grading request for already encoded photos and return the model's reply text
+        
+        Several photos are only supported with OpenAI.
+        """
+        if not self.use_openai:
+            # LLaVA's free-text reasoning and caption are left uncapped
+            return await self._chat_vision(OLLAMA_PROMPT, encodings[:1], max_tokens=None)
+        if len(encodings) == 1:
+            return await self._chat_vision(OPENAI_PROMPT, encodings, max_tokens=500)
+        return await self._chat_vision(openai_batch_prompt(file_names), encodings,
+                                       max_tokens=500 * len(encodings), timeout=30 * len(encodings))
+    
+    def _parse_evaluation(self, file_names, reply):
+        """Turn a grading reply into one result per file (None where a multi-photo reply skipped one)"""
+        if not self.use_openai:
+            return [self._ollama_result(reply)]
+        if len(file_names) == 1:
+            return [self._openai_result(reply)]
+        return self._openai_batch_results(file_names, reply)
+    
+    def _finish_result(self, image_path, result):
+        """Tag a fresh result with its file and store it in the result cache"""
+        result['file'] = os.path.basename(image_path)
+        result['path'] = image_path
+        try:
+            self.remember_result(image_path, result)
+        except Exception as e:
+            # Losing the cache entry costs a re-evaluation next run, never this run's result
+            print(f"⚠️  Could not cache result for {result['file']}: {e}")
+        return result
+    
+    async def evaluate_with_openai(self, image_path):
+        """Evaluate using GPT-4V"""
+        async with self._http_session():
+            base64_image = await self.encode_image_async(image_path)
+            if base64_image is None:
+                return {"score": 0, "reasoning": "Could not read image"}
             
             try:
-                response = requests.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=30
-                )
-                
-                if response.status_code == 200:
-                    content = response.json()['choices'][0]['message']['content'].strip().upper()
-                    # Be conservative - only return True if explicitly SIMILAR
-                    return content == "SIMILAR"
+                reply = await self._send_evaluation([os.path.basename(image_path)], [base64_image])
+            except Exception as e:
+                return self._error_result(e)
+        return self._openai_result(reply)
+    
+    def evaluate_with_batch_api(self, image_files):
+        """Evaluate photos through the OpenAI Batch API (half price, results within 24h)
+        
+        Writes one chat completion request per photo to JSONL files (split to stay within the
+        Batch API's input file limits), uploads them and starts one batch per file, polls until
+        they finish, then downloads and parses the output files.
+        """
+        auth = {"Authorization": f"Bearer {self.api_key}"}
+        results = {}
+        batch_paths = []
+        
+        try:
+            print("Encoding photos for the batch...")
+            self._write_batch_files(image_files, results, batch_paths)
+            if len(batch_paths) > 1:
+                print(f"Splitting into {len(batch_paths)} batches to stay under the Batch API input file limits")
+            
+            # Submit everything first so OpenAI works on the batches side by side
+            batches = []
+            for path in batch_paths:
+                try:
+                    batches.append(self._submit_batch(path, auth))
+                except Exception as e:
+                    print(f"❌ Batch API error: {e}")
+            for batch in batches:
+                try:
+                    self._collect_batch(batch, auth, image_files, results)
+                except Exception as e:
+                    print(f"❌ Batch API error: {e}")
+        except Exception as e:
+            print(f"❌ Batch API error: {e}")
+        finally:
+            for path in batch_paths:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+        
+        evaluated = []
+        for image_file in image_files:
+            result = results.get(image_file, {"score": 0, "reasoning": "No result returned by batch"})
+            evaluated.append(self._finish_result(image_file, result))
+        return [r for r in evaluated if r.get('score', 0) > 0]
+    
+    def _write_batch_files(self, image_files, results, batch_paths):
+        """Encode photos into Batch API JSONL input files, appending each file's path to batch_paths
+        
+        custom_id is the photo's index in image_files. Photos that can't be sent get their
+        result in results right away.
+        """
+        pieces = request_template(True, OPENAI_PROMPT, 1, 500)
+        batch_file = None
+        requests_in_file = 0
+        try:
+            with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+                encodings = pool.map(encode_image_file, image_files, [self.max_dim] * len(image_files))
+                for i, (image_file, base64_image) in enumerate(zip(image_files, encodings)):
+                    if base64_image is None:
+                        results[image_file] = {"score": 0, "reasoning": "Could not read image"}
+                        continue
+                    prefix = b'{"custom_id":"%d","method":"POST","url":"/v1/chat/completions","body":' % i
+                    parts = splice_images(pieces, [base64_image])
+                    line_size = len(prefix) + sum(len(part) for part in parts) + 2
+                    if line_size > BATCH_FILE_MAX_BYTES:
+                        print(f"⚠️  {os.path.basename(image_file)} is too large for a Batch API input file, "
+                              f"skipping it (try a smaller --max-dim)")
+                        results[image_file] = {"score": 0, "reasoning": "Too large for the Batch API"}
+                        continue
+                    if (batch_file is None or batch_file.tell() + line_size > BATCH_FILE_MAX_BYTES
+                            or requests_in_file >= BATCH_MAX_REQUESTS):
+                        if batch_file is not None:
+                            batch_file.close()
+                        batch_file = tempfile.NamedTemporaryFile('wb', suffix='.jsonl', delete=False)
+                        batch_paths.append(batch_file.name)
+                        requests_in_file = 0
+                    # Write the request line in pieces so the base64 image is never copied into
+                    # a str or a joined bytes object
+                    batch_file.write(prefix)
+                    batch_file.writelines(parts)
+                    batch_file.write(b'}\n')
+                    requests_in_file += 1
+        finally:
+            if batch_file is not None:
+                batch_file.close()
+    
+    def _submit_batch(self, path, auth):
+        """Upload a JSONL input file and start a batch on it"""
+        with open(path, 'rb') as f:
+            response = self.session.post(
+                "https://api.openai.com/v1/files",
+                headers=auth,
+                data={"purpose": "batch"},
+                files={"file": (os.path.basename(path), f, "application/jsonl")},
+                timeout=600
+            )
+        response.raise_for_status()
+        input_file_id = orjson.loads(response.content)['id']
+        
+        response = self.session.post(
+            "https://api.openai.com/v1/batches",
+            headers=auth,
+            json={
+                "input_file_id": input_file_id,
+                "endpoint": "/v1/chat/completions",
+                "completion_window": "24h"
+            },
+            timeout=30
+        )
+        response.raise_for_status()
+        batch = orjson.loads(response.content)
+        print(f"Submitted batch {batch['id']} - waiting for OpenAI to finish (can take up to 24h)...")
+        return batch
+    
+    def _collect_batch(self, batch, auth, image_files, results):
+        """Wait for a batch to finish and store its results by photo path in results"""
+        # Poll with exponential backoff, capped at 5 minutes between checks
+        delay = 5
+        while batch['status'] in ('validating', 'in_progress', 'finalizing', 'cancelling'):
+            time.sleep(delay)
+            delay = min(delay * 2, 300)
+            response = self.session.get(f"https://api.openai.com/v1/batches/{batch['id']}",
+                                        headers=auth, timeout=30)
+            response.raise_for_status()
+            batch = orjson.loads(response.content)
+            counts = batch.get('request_counts') or {}
+            print(f"   Batch {batch['id']} {batch['status']}: {counts.get('completed', 0)}/{counts.get('total', '?')} done")
+
+        if batch['status'] != 'completed':
+            print(f"⚠️  Batch {batch['id']} ended with status '{batch['status']}', using whatever results it produced")
+
+        for file_key in ('output_file_id', 'error_file_id'):
+            if not batch.get(file_key):
+                continue
+            response = self.session.get(f"https://api.openai.com/v1/files/{batch[file_key]}/content",
+                                        headers=auth, timeout=600)
+            response.raise_for_status()
+            for line in response.content.splitlines():
+                if not line.strip():
+                    continue
+                item = orjson.loads(line)
+                image_file = image_files[int(item['custom_id'])]
+                reply = item.get('response') or {}
+                if reply.get('status_code') == 200:
+                    content = reply['body']['choices'][0]['message']['content']
+                    results[image_file] = self._openai_result(content)
                 else:
-                    return False
-                    
+                    error = item.get('error') or reply.get('body')
+                    results[image_file] = {"score": 0, "reasoning": f"API Error: {reply.get('status_code')}",
+                                           "error": error}
+    
+    async def evaluate_with_ollama(self, image_path):
+        """Evaluate using local Ollama with vision model"""
+        async with self._http_session():
+            base64_image = await self.encode_image_async(image_path)
+            if base64_image is None:
+                return {"score": 0, "reasoning": "Could not read image"}
+            
+            try:
+                reply = await self._send_evaluation([os.path.basename(image_path)], [base64_image])
             except Exception as e:
-                print(f"   ⚠️  Error comparing {os.path.basename(image_path1)} & {os.path.basename(image_path2)}: {e}")
+                return self._error_result(e)
+        return self._ollama_result(reply)
+    
+    async def are_photos_similar(self, image_path1, image_path2):
+        """Check if two photos are similar shots of the same subject"""
+        if not self.detect_duplicates:
+            return False
+        
+        # Don't compare if either image failed to load during evaluation
+        # This prevents false positives from failed images
+        if not os.path.exists(image_path1) or not os.path.exists(image_path2):
+            return False
+        
+        async with self._http_session():
+            base64_image1, base64_image2 = await asyncio.gather(
+                self.encode_image_async(image_path1, remember=True),
+                self.encode_image_async(image_path2, remember=True))
+            
+            if base64_image1 is None or base64_image2 is None:
                 return False
-        else:
-            # Use Ollama with LLaVA - but it's less reliable for comparisons
+            
             try:
-                response = requests.post(
-                    'http://localhost:11434/api/generate',
-                    json={
-                        'model': 'llava:latest',
-                        'prompt': prompt,
-                        'images': [base64_image1, base64_image2],
-                        'stream': False
-                    },
-                    timeout=60
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    response_text = result.get('response', '').strip().upper()
-                    # Be very conservative with Ollama - only trust clear SIMILAR responses
-                    return "SIMILAR" in response_text and "DIFFERENT" not in response_text
-                else:
-                    return False
-                    
+                reply = await self._chat_vision(SIMILARITY_PROMPT, [base64_image1, base64_image2],
+                                                max_tokens=20, json_schema=SIMILARITY_SCHEMA)
             except Exception as e:
-                print(f"   ⚠️  Error comparing with Ollama: {e}")
+                print(f"   ⚠️  Error comparing {os.path.basename(image_path1)} & {os.path.basename(image_path2)}: {e}")
                 return False
         
-        return False
+        # Be conservative - only return True for an explicit {"similar": true}
+        answer = extract_json(reply)
+        return isinstance(answer, dict) and answer.get('similar') is True
     
-    def group_similar_photos(self, results):
+    async def group_similar_photos(self, results):
         """Group similar photos and return the best from each group"""
         if not self.detect_duplicates or len(results) < 2:
             return results
             
         print(f"\n🔍 Checking for duplicate/similar shots among {len(results)} photos...")
         
-        # Filter out failed photos first
-        valid_results = [r for r in results if r.get('score', 0) > 0]
-        failed_results = [r for r in results if r.get('score', 0) == 0]
+        # Filter out failed photos first, including ones that failed the local focus check,
+        # which must not cost vision API comparisons either
+        valid_results = [r for r in results if r.get('score', 0) > 0 and not r.get('blurry')]
+        failed_results = [r for r in results if r.get('score', 0) == 0 or r.get('blurry')]
         
         if len(valid_results) < 2:
             print("   ⚠️  Too few valid photos for duplicate detection")
             return results
         
-        groups = []
-        processed = set()
-        comparison_count = 0
-        max_comparisons = len(valid_results) * 5  # Safety limit
+        # Hash every photo once; most pairs are then decided locally without an API call
+        hashes = {r['path']: perceptual_hash(r['path']) for r in valid_results}
+        
+        # Union-find over photo paths: every "similar" verdict merges two groups
+        parent = {r['path']: r['path'] for r in valid_results}
+        
+        def find(path):
+            while parent[path] != path:
+                parent[path] = parent[parent[path]]  # path halving
+                path = parent[path]
+            return path
+        
+        def union(path1, path2):
+            parent[find(path2)] = find(path1)
+        
+        hash_decisions = 0
+        ambiguous = []  # pairs only the vision model can settle
         
         for i, result1 in enumerate(valid_results):
-            if result1['path'] in processed:
-                continue
-                
-            # Start a new group with this photo
-            current_group = [result1]
-            processed.add(result1['path'])
-            
-            # Find all similar photos
-            for j, result2 in enumerate(valid_results[i+1:], i+1):
-                if result2['path'] in processed:
-                    continue
-                
-                # Safety check - limit total comparisons to prevent runaway processing
-                comparison_count += 1
-                if comparison_count > max_comparisons:
-                    print(f"   ⚠️  Stopping duplicate detection after {comparison_count} comparisons (safety limit)")
-                    break
+            for result2 in valid_results[i+1:]:
+                path1, path2 = result1['path'], result2['path']
+                if find(path1) == find(path2):
+                    continue  # already grouped through other photos
                 
-                # Limit group size - if we already have 10 in a group, something's wrong
-                if len(current_group) >= 10:
-                    print(f"   ⚠️  Group too large ({len(current_group)} photos), stopping growth")
-                    break
+                hash1, hash2 = hashes[path1], hashes[path2]
+                distance = hamming_distance(hash1, hash2) if hash1 is not None and hash2 is not None else None
                 
-                if self.are_photos_similar(result1['path'], result2['path']):
-                    current_group.append(result2)
-                    processed.add(result2['path'])
+                if distance is not None and distance > PHASH_DIFFERENT_DISTANCE:
+                    hash_decisions += 1
+                elif distance is not None and distance <= PHASH_SIMILAR_DISTANCE:
+                    hash_decisions += 1
+                    union(path1, path2)
                     print(f"   📎 Found similar: {result1['file']} & {result2['file']}")
+                else:
+                    ambiguous.append((result1, result2))
+        
+        # Ask about the borderline pairs concurrently, skipping any that the hash matches
+        # above already joined through other photos
+        ambiguous = [(r1, r2) for r1, r2 in ambiguous if find(r1['path']) != find(r2['path'])]
+        comparison_count = len(ambiguous)
+        if ambiguous:
+            sem = asyncio.Semaphore(self.concurrency)
             
-            groups.append(current_group)
+            async def compare(result1, result2):
+                async with sem:
+                    return await self.are_photos_similar(result1['path'], result2['path'])
             
-            # If this group got suspiciously large, stop processing
-            if len(current_group) > 5:
-                print(f"   ⚠️  Large group detected ({len(current_group)} photos), may indicate comparison issues")
+            async with self._http_session():
+                verdicts = await asyncio.gather(*(compare(r1, r2) for r1, r2 in ambiguous))
+            for (result1, result2), similar in zip(ambiguous, verdicts):
+                if similar:
+                    union(result1['path'], result2['path'])
+                    print(f"   📎 Found similar: {result1['file']} & {result2['file']}")
         
-        # Add any unprocessed photos as individual groups
+        groups_by_root = {}
         for result in valid_results:
-            if result['path'] not in processed:
-                groups.append([result])
+            groups_by_root.setdefault(find(result['path']), []).append(result)
+        groups = list(groups_by_root.values())
         
         # From each group, pick the highest scoring photo
         best_from_each_group = []
@@ -362,7 +1057,7 @@ Respond with only: SIMILAR or DIFFERENT"""
             if len(group) > 1:
                 duplicate_count += len(group) - 1
                 # Sort by score and take the best
-                group.sort(key=lambda x: x.get('score', 0), reverse=True)
+                group.sort(key=result_score, reverse=True)
                 best = group[0]
                 best['similar_shots'] = len(group)
                 best['alternatives'] = [photo['file'] for photo in group[1:]]
@@ -380,69 +1075,272 @@ Respond with only: SIMILAR or DIFFERENT"""
         print(f"   • Found {len(groups)} unique shots")
         print(f"   • Removed {duplicate_count} duplicates/similar photos")
         print(f"   • {len(best_from_each_group)} photos remain")
-        print(f"   • Made {comparison_count} photo comparisons")
+        print(f"   • Made {comparison_count} AI photo comparisons ({hash_decisions} pairs decided by perceptual hash)")
         
         return best_from_each_group
     
-    def evaluate_photo(self, image_path):
+    @contextlib.asynccontextmanager
+    async def _http_session(self):
+        """Share one aiohttp session and encoding process pool between everything running at once
+        
+        Nested and concurrent users (e.g. gathered evaluate_photo calls) all share them, and
+        they are closed when the last user exits rather than when the first one does.
+        """
+        self._http_users += 1
+        try:
+            if self._http is None:
+                # One session for the whole run so connections are kept alive and shared
+                connector = aiohttp.TCPConnector(limit=32, limit_per_host=16, keepalive_timeout=60)
+                self._encode_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+                self._http = aiohttp.ClientSession(connector=connector)
+                self._limiter = AdaptiveLimiter(self.concurrency)
+            yield
+        finally:
+            self._http_users -= 1
+            if self._http_users == 0 and self._http is not None:
+                session, pool = self._http, self._encode_pool
+                self._limiter.close()
+                self._http = self._encode_pool = self._limiter = None
+                await session.close()
+                pool.shutdown()
+    
+    async def evaluate_photo(self, image_path):
         """Evaluate a single photo"""
         if not os.path.exists(image_path):
             return None
+        
+        cached = self.cached_result(image_path)
+        if cached is not None:
+            return cached
             
         print(f"Evaluating: {os.path.basename(image_path)}")
         
-        if self.use_openai:
-            result = self.evaluate_with_openai(image_path)
-        else:
-            result = self.evaluate_with_ollama(image_path)
+        async with self._http_session():
+            if self.use_openai:
+                result = await self.evaluate_with_openai(image_path)
+            else:
+                result = await self.evaluate_with_ollama(image_path)
         
-        result['file'] = os.path.basename(image_path)
-        result['path'] = image_path
-        return result
+        return self._finish_result(image_path, result)
+    
+    async def evaluate_folder_async(self, image_files):
+        """Evaluate images through a staged encode -> send -> parse pipeline
+        
+        Each stage has its own workers with a bounded queue in front, so JPEG/base64 work in
+        the process pool, HTTP requests and response parsing overlap continuously instead of
+        every photo hitting the same phase at the same time. At most self.concurrency requests
+        are in flight.
+        """
+        if not image_files:
+            return []
+        
+        results = []
+        all_done = asyncio.Event()
+        
+        def report(image_file, result):
+            results.append(result)
+            print(f"\nProcessed {len(results)}/{len(image_files)}: {os.path.basename(image_file)}")
+            if result and result.get('score', 0) > 0:
+                print(f"  Score: {result['score']}/100")
+                if 'reasoning' in result:
+                    print(f"  Reason: {result['reasoning']}")
+                if 'caption' in result:
+                    print(f"  📱 Caption: {result['caption']}")
+            if len(results) == len(image_files):
+                all_done.set()
+        
+        # Work items are groups of paths: one photo per request, or several with --images-per-call
+        size = self.images_per_call if self.use_openai else 1
+        encode_q = asyncio.Queue()
+        send_q = asyncio.Queue(maxsize=self.concurrency * 2)
+        parse_q = asyncio.Queue(maxsize=self.concurrency * 2)
+        for i in range(0, len(image_files), size):
+            encode_q.put_nowait(image_files[i:i + size])
+        
+        async def encode_worker():
+            while True:
+                group = await encode_q.get()
+                encodings = await asyncio.gather(*(self.encode_image_async(p) for p in group))
+                readable = []
+                for image_file, base64_image in zip(group, encodings):
+                    if base64_image is None:
+                        report(image_file, self._finish_result(image_file, {"score": 0, "reasoning": "Could not read image"}))
+                    else:
+                        readable.append((image_file, base64_image))
+                if readable:
+                    await send_q.put(readable)
+        
+        async def send_worker():
+            while True:
+                item = await send_q.get()
+                names = [os.path.basename(image_file) for image_file, _ in item]
+                print(f"Evaluating: {', '.join(names)}")
+                # Random jitter keeps parallel requests from bursting in lockstep
+                await asyncio.sleep(random.uniform(0, 0.2))
+                try:
+                    reply = await self._send_evaluation(names, [base64_image for _, base64_image in item])
+                    await parse_q.put(([image_file for image_file, _ in item], reply, None))
+                except Exception as e:
+                    await parse_q.put(([image_file for image_file, _ in item], None, e))
+        
+        async def parse_worker():
+            while True:
+                group, reply, error = await parse_q.get()
+                # A malformed reply fails its own photos, not the whole run
+                finished, retry = [], []
+                try:
+                    if error is not None:
+                        raise error
+                    group_results = self._parse_evaluation([os.path.basename(p) for p in group], reply)
+                    for image_file, result in zip(group, group_results):
+                        if result is None:
+                            retry.append(image_file)
+                        else:
+                            finished.append((image_file, self._finish_result(image_file, result)))
+                except Exception as e:
+                    finished = [(image_file, self._finish_result(image_file, self._error_result(e)))
+                                for image_file in group]
+                    retry = []
+                for image_file, result in finished:
+                    report(image_file, result)
+                for image_file in retry:
+                    # The model skipped this photo in its combined answer, grade it alone
+                    await encode_q.put([image_file])
+        
+        async with self._http_session():
+            workers = ([encode_worker() for _ in range(os.cpu_count() or 1)] +
+                       [send_worker() for _ in range(self.concurrency)] +
+                       [parse_worker() for _ in range(2)])
+            tasks = [asyncio.ensure_future(worker) for worker in workers]
+            done_task = asyncio.ensure_future(all_done.wait())
+            try:
+                # Workers loop forever; stop them once every photo has a result, or as soon
+                # as one of them crashes rather than waiting on a photo that never arrives
+                await asyncio.wait([done_task, *tasks], return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task.done() and not task.cancelled() and task.exception():
+                        raise task.exception()
+            finally:
+                done_task.cancel()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+        
+        return [r for r in results if r and r.get('score', 0) > 0]
+    
+    def _split_cached(self, image_files):
+        """Separate photos that already have a cached result from those needing an API call
+        
+        Returns (cached results, photos to evaluate, {identical copy: photo it duplicates}).
+        """
+        def content_key(image_file):
+            try:
+                return self._content_key(image_file)
+            except OSError:
+                return None
+        
+        # hashlib releases the GIL, so a thread pool hashes files in parallel
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            keys = list(pool.map(content_key, image_files))
+        
+        cached, to_evaluate, copies = [], [], {}
+        first_with_key = {}
+        for image_file, key in zip(image_files, keys):
+            result = self.cached_result(image_file) if key is not None else None
+            if result is not None:
+                cached.append(result)
+            elif key is not None and key in first_with_key:
+                copies[image_file] = first_with_key[key]
+            else:
+                if key is not None:
+                    first_with_key[key] = image_file
+                to_evaluate.append(image_file)
+        return cached, to_evaluate, copies
+    
+    def _split_blurry(self, image_files):
+        """Fail out-of-focus photos locally instead of paying for a vision request
+        
+        Returns (results for blurry photos, photos sharp enough to evaluate). Blurry results
+        are not written to the result cache, so changing the threshold takes effect next run.
+        """
+        if not self.blur_threshold or not image_files:
+            return [], image_files
+        
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            variances = list(pool.map(sharpness, image_files, chunksize=8))
+        
+        blurry, sharp = [], []
+        for image_file, variance in zip(image_files, variances):
+            # Unreadable files go on to the normal path, which reports them properly
+            if variance is not None and variance < self.blur_threshold:
+                blurry.append({
+                    "score": BLURRY_SCORE,
+                    "reasoning": f"Failed local focus check (sharpness {variance:.0f} < {self.blur_threshold:g}), not sent for AI evaluation",
+                    "main_subject": "Out of focus",
+                    "sharpness": round(float(variance), 1),
+                    "blurry": True,
+                    "file": os.path.basename(image_file),
+                    "path": image_file
+                })
+            else:
+                sharp.append(image_file)
+        return blurry, sharp
     
     def evaluate_folder(self, folder_path, output_file=None):
         """Evaluate all images in a folder"""
-        folder = Path(folder_path)
-        if not folder.exists():
+        if not os.path.isdir(folder_path):
             print(f"Folder {folder_path} does not exist")
             return []
         
         extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'}
-        image_files = [f for f in folder.iterdir() 
-                      if f.suffix.lower() in extensions]
+        # scandir's entries carry the file type from the directory listing, so checking
+        # is_file() needs no extra stat call (except for symlinks, which are still followed)
+        with os.scandir(folder_path) as entries:
+            image_files = [entry.path for entry in entries
+                          if os.path.splitext(entry.name)[1].lower() in extensions and entry.is_file()]
         
         if not image_files:
             print(f"No image files found in {folder_path}")
             return []
         
-        print(f"Evaluating {len(image_files)} images for social media appeal...")
-        if not self.use_openai:
-            print("Using Ollama - make sure 'ollama serve' is running and 'llava:latest' is installed")
+        results, to_evaluate, copies = self._split_cached(image_files)
+        if results:
+            print(f"♻️  Reusing cached results for {len(results)} images (use --force to re-evaluate)")
         
-        results = []
-        for i, image_file in enumerate(image_files, 1):
-            print(f"\nProcessing {i}/{len(image_files)}: {image_file.name}")
-            result = self.evaluate_photo(str(image_file))
-            if result and result.get('score', 0) > 0:
-                results.append(result)
-                print(f"  Score: {result['score']}/100")
-                if 'reasoning' in result:
-                    print(f"  Reason: {result['reasoning']}")
-                if 'caption' in result:
-                    print(f"  📱 Caption: {result['caption']}")
+        blurry, to_evaluate = self._split_blurry(to_evaluate)
+        if blurry:
+            print(f"🌫️  Skipping {len(blurry)} out-of-focus images (use --blur-threshold 0 to send them anyway)")
+            results += blurry
+        
+        try:
+            if not to_evaluate:
+                pass
+            elif self.use_batch_api:
+                print(f"Evaluating {len(to_evaluate)} images for social media appeal via the OpenAI Batch API...")
+                results += self.evaluate_with_batch_api(to_evaluate)
+            else:
+                print(f"Evaluating {len(to_evaluate)} images for social media appeal ({self.concurrency} at a time)...")
+                if not self.use_openai:
+                    print("Using Ollama - make sure 'ollama serve' is running and 'llava:latest' is installed")
+                
+                results += asyncio.run(self.evaluate_folder_async(to_evaluate))
+        finally:
+            self.save_result_cache()
         
-        # Sort by score
-        results.sort(key=lambda x: x.get('score', 0), reverse=True)
+        # Byte-identical files were only sent once; give each copy the same evaluation
+        by_path = {r['path']: r for r in results}
+        for image_file, original in copies.items():
+            if original in by_path:
+                results.append(dict(by_path[original], file=os.path.basename(image_file), path=image_file))
         
         # Group similar photos and pick the best from each group
         if self.detect_duplicates:
-            results = self.group_similar_photos(results)
-            # Re-sort after grouping
-            results.sort(key=lambda x: x.get('score', 0), reverse=True)
+            results = asyncio.run(self.group_similar_photos(results))
         
+        # Results stay unordered; only the saved file needs every photo ranked
         if output_file:
             with open(output_file, 'w') as f:
-                json.dump(results, f, indent=2)
+                json.dump(sorted(results, key=result_score, reverse=True), f, indent=2)
             print(f"\nResults saved to {output_file}")
         
         return results
@@ -457,7 +1355,7 @@ Respond with only: SIMILAR or DIFFERENT"""
         print(f"TOP {min(top_n, len(results))} PHOTOS FOR SOCIAL MEDIA")
         print(f"{'='*80}")
         
-        for i, result in enumerate(results[:top_n], 1):
+        for i, result in enumerate(heapq.nlargest(top_n, results, key=result_score), 1):
             print(f"\n{i}. {result['file']}")
             print(f"   Score: {result.get('score', 0)}/100")
             
@@ -495,23 +1393,48 @@ def main():
     parser.add_argument('--openai-api-key', help='OpenAI API key for GPT-4V (otherwise uses Ollama)')
     parser.add_argument('--no-duplicates', action='store_true', 
                        help='Skip duplicate detection (faster but may include similar shots)')
+    parser.add_argument('--concurrency', type=int, default=None,
+                       help='Maximum photos evaluated in parallel, lowered automatically when rate limited '
+                            '(default: 8 for OpenAI, OLLAMA_NUM_PARALLEL or 2 for Ollama)')
+    parser.add_argument('--max-dim', type=int, default=1024,
+                       help='Downscale photos so the longest side is at most this many pixels before upload '
+                            '(default: 1024, 0 sends originals)')
+    parser.add_argument('--images-per-call', type=int, default=1,
+                       help='Photos graded together in one OpenAI request, sharing the prompt (default: 1, '
+                            'try 4-8 to cut request count and prompt tokens; ignored for Ollama)')
+    parser.add_argument('--force', action='store_true',
+                       help='Re-evaluate every photo instead of reusing cached results from earlier runs')
+    parser.add_argument('--blur-threshold', type=float, default=BLUR_THRESHOLD,
+                       help=f'Photos with a Laplacian focus measure below this are scored {BLURRY_SCORE} without an '
+                            f'API call (default: {BLUR_THRESHOLD:g}, 0 disables the check)')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--batch', action='store_true',
+                     help='Submit OpenAI evaluations through the Batch API (50%% cheaper, results can take up to 24h)')
+    mode.add_argument('--realtime', action='store_true',
+                     help='Evaluate with live OpenAI requests (default)')
     
     args = parser.parse_args()
     
+    if args.batch and not args.openai_api_key:
+        print("⚠️  --batch needs --openai-api-key, evaluating with Ollama in real time instead")
+    
     detect_duplicates = not args.no_duplicates
     if detect_duplicates:
         print("🔍 Duplicate detection enabled - will group similar shots and pick the best from each group")
     else:
         print("⚡ Duplicate detection disabled - processing all photos independently")
     
-    evaluator = AIPhotoEvaluator(api_key=args.openai_api_key, detect_duplicates=detect_duplicates)
+    evaluator = AIPhotoEvaluator(api_key=args.openai_api_key, detect_duplicates=detect_duplicates,
+                                 concurrency=args.concurrency, max_dim=args.max_dim,
+                                 images_per_call=args.images_per_call, use_batch_api=args.batch,
+                                 force=args.force, blur_threshold=args.blur_threshold)
     results = evaluator.evaluate_folder(args.folder, args.output)
     evaluator.print_top_results(results, args.top)
     
     # Save captions separately if requested
     if args.captions and results:
         caption_data = []
-        for result in results[:args.top]:
+        for result in heapq.nlargest(args.top, results, key=result_score):
             if 'caption' in result:
                 caption_data.append({
                     'file': result['file'],
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Unit tests for the pure helpers in ai_photo_evaluator.py
+Run with: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import orjson
+
+import ai_photo_evaluator
+from ai_photo_evaluator import AIPhotoEvaluator, coerce_score
+
+
+def batch_reply(entries):
+    return orjson.dumps({"results": entries}).decode()
+
+
+class OpenAIBatchResultsTest(unittest.TestCase):
+    def setUp(self):
+        self.evaluator = AIPhotoEvaluator(api_key="test-key")
+
+    def test_matches_entries_by_file_name(self):
+        reply = batch_reply([{"file": "b.jpg", "score": 20}, {"file": "a.jpg", "score": 10}])
+        results = self.evaluator._openai_batch_results(["a.jpg", "b.jpg"], reply)
+        self.assertEqual(results, [{"score": 10}, {"score": 20}])
+
+    def test_falls_back_to_answer_order_when_no_name_matches(self):
+        reply = batch_reply([{"file": "1", "score": 10}, {"file": "2", "score": 20}])
+        results = self.evaluator._openai_batch_results(["a.jpg", "b.jpg"], reply)
+        self.assertEqual(results, [{"score": 10}, {"score": 20}])
+
+    def test_never_gives_one_entry_to_two_files(self):
+        reply = batch_reply([{"file": "b.jpg", "score": 90}, {"file": "B.JPG", "score": 10},
+                             {"file": "c.jpg", "score": 50}])
+        results = self.evaluator._openai_batch_results(["a.jpg", "b.jpg", "c.jpg"], reply)
+        self.assertIsNone(results[0])
+        self.assertEqual(results[1], {"score": 90})
+        self.assertEqual(results[2], {"score": 50})
+
+    def test_results_are_independent_copies(self):
+        reply = batch_reply([{"file": "a.jpg", "score": 10}, {"file": "a.jpg", "score": 20}])
+        results = self.evaluator._openai_batch_results(["a.jpg", "a.jpg"], reply)
+        self.assertIsNot(results[0], results[1])
+        results[0]["file"] = "changed"
+        self.assertNotIn("file", results[1])
+
+    def test_missing_results_leave_every_file_ungraded(self):
+        for reply in ('{"results": null}', '{"results": 5}', '[1, 2]', 'no json here'):
+            self.assertEqual(self.evaluator._openai_batch_results(["a.jpg", "b.jpg"], reply), [None, None])
+
+    def test_entries_with_unusable_scores_become_parse_errors(self):
+        reply = batch_reply([{"file": "a.jpg", "score": None}, {"file": "b.jpg", "score": "85"}])
+        results = self.evaluator._openai_batch_results(["a.jpg", "b.jpg"], reply)
+        self.assertEqual(results[0]["reasoning"], "Could not parse AI response")
+        self.assertEqual(results[1], {"score": 85})
+
+
+class OpenAIResultTest(unittest.TestCase):
+    def setUp(self):
+        self.evaluator = AIPhotoEvaluator(api_key="test-key")
+
+    def test_coerces_numeric_scores(self):
+        self.assertEqual(self.evaluator._openai_result('{"score": "72/100"}')["score"], 72)
+        self.assertEqual(self.evaluator._openai_result('{"score": 88.6}')["score"], 88)
+
+    def test_unusable_scores_become_parse_errors(self):
+        for reply in ('{"score": null}', '{"score": "great"}', '{"reasoning": "no score"}', '[1, 2]'):
+            result = self.evaluator._openai_result(reply)
+            self.assertEqual(result["reasoning"], "Could not parse AI response")
+            self.assertEqual(result["error"], reply)
+
+
+class CoerceScoreTest(unittest.TestCase):
+    def test_clamps_to_valid_range(self):
+        self.assertEqual(coerce_score(0), 1)
+        self.assertEqual(coerce_score(250), 100)
+        self.assertEqual(coerce_score(" 40 "), 40)
+
+    def test_rejects_non_numbers(self):
+        for value in (None, True, "", "n/a", [], {}, float("inf")):
+            self.assertIsNone(coerce_score(value))
+
+
+class EncodingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.evaluator = AIPhotoEvaluator()
+        self.stat = os.stat(__file__)
+        self.limit = ai_photo_evaluator.B64_CACHE_BYTES
+        ai_photo_evaluator.B64_CACHE_BYTES = 10
+
+    def tearDown(self):
+        ai_photo_evaluator.B64_CACHE_BYTES = self.limit
+
+    def test_evicts_least_recently_used_by_total_bytes(self):
+        for path in ("a", "b", "c"):
+            self.evaluator._remember_encoding(path, self.stat, b"1234")
+        self.assertEqual(list(self.evaluator._b64_cache), ["b", "c"])
+        self.assertEqual(self.evaluator._b64_cache_bytes, 8)
+
+    def test_skips_encodings_larger_than_the_cache(self):
+        self.evaluator._remember_encoding("a", self.stat, b"x" * 11)
+        self.assertEqual(len(self.evaluator._b64_cache), 0)
+        self.assertEqual(self.evaluator._b64_cache_bytes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()